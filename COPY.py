@@ -1,8 +1,14 @@
 import streamlit as st
-from lxml import etree
 import re
 import os
+import sys
+import hashlib
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from collections import defaultdict
+from index_cache import MEMORY_KEEP, iter_indexed_elements, read_saved_index, save_index
 
 # ================================
 # Page Config
@@ -18,53 +24,37 @@ st.set_page_config(
 # ================================
 if 'xml_loaded' not in st.session_state:
     st.session_state.xml_loaded = False
-if 'root' not in st.session_state:
-    st.session_state.root = None
-if 'diag_index' not in st.session_state:
-    st.session_state.diag_index = None
+if 'xml_digest' not in st.session_state:
+    st.session_state.xml_digest = None
 if 'history' not in st.session_state:
     st.session_state.history = []
 if 'query' not in st.session_state:
     st.session_state.query = ''
 if 'should_search' not in st.session_state:
     st.session_state.should_search = False
+if 'index_job' not in st.session_state:
+    st.session_state.index_job = None
 
 # ================================
-# File Upload Section
+# Parse & Index by ObjectID
 # ================================
-st.title("🚗 Vehicle Diagnostic System Query")
+# The three sections linked by ObjectID
+INDEXED_TAGS = ('DataObjects', 'ExceptionMetadata', 'DataPointMetadata')
 
-if not st.session_state.xml_loaded:
-    st.markdown("### 📁 Upload Your XML Data Dictionary")
-    st.info("Upload your vehicle diagnostic XML file to begin querying.")
-    
-    uploaded_file = st.file_uploader(
-        "Choose an XML file",
-        type=['xml'],
-        help="Upload your data_dictionary.xml file"
-    )
-    
-    if uploaded_file is not None:
-        try:
-            with st.spinner("🔄 Loading XML file..."):
-                # Parse XML from uploaded file
-                tree = etree.parse(uploaded_file)
-                st.session_state.root = tree.getroot()
-                st.session_state.xml_loaded = True
-                st.success("✅ XML file loaded successfully!")
-                st.rerun()
-        except Exception as e:
-            st.error(f"❌ Error loading XML: {str(e)}")
-            st.stop()
-    else:
-        st.warning("⬆️ Please upload an XML file to continue")
-        st.stop()
+# Word tokens for the description search index
+_RE_WORD = re.compile(r'\w+')
 
-# ================================
-# Parse & Index by ObjectID
-# ================================
-def build_diagnostic_index(root):
-    """Build a comprehensive index linking ObjectIDs across all three sections"""
+def normalize_object_id(obj_id):
+    """Numeric ObjectIDs are keyed as ints: smaller keys and cheaper hashing"""
+    if isinstance(obj_id, str) and obj_id.isdecimal():
+        number = int(obj_id)
+        # IDs with leading zeros would not round-trip, so they stay strings
+        if str(number) == obj_id:
+            return number
+    return obj_id
+
+def build_diagnostic_index(xml_file):
+    """Stream the XML once and index ObjectIDs across all three sections"""
     index = {
         'data_objects': {},
         'exceptions': {},
@@ -72,63 +62,230 @@ def build_diagnostic_index(root):
         'bus_types': set(),
         'manufacturers': set(),
         'flash_codes': {},
-        'severity_levels': set()
+        'severity_levels': set(),
     }
     
-    # Index DataObjects
-    for elem in root.xpath('.//DataObjects'):
-        obj_id = elem.get('ObjectID')
-        if obj_id:
-            index['data_objects'][obj_id] = {
-                'description': elem.get('Description', ''),
-                'unit_text': elem.get('UnitText', ''),
+    # Local names for the hot loop instead of an index[...] lookup per element
+    data_objects = index['data_objects']
+    exceptions = index['exceptions']
+    metadata = index['metadata']
+    flash_codes = index['flash_codes']
+    severity_levels = index['severity_levels']
+    bus_types = index['bus_types']
+    manufacturers = index['manufacturers']
+    
+    # Bus types, manufacturers, firmware and severities repeat across thousands
+    # of rows; interning keeps one shared string object per distinct value
+    intern = sys.intern
+    to_key = normalize_object_id
+    
+    for tag, obj_id, attrib in iter_indexed_elements(xml_file, INDEXED_TAGS):
+        obj_id = to_key(obj_id)
+    
+        # Index DataObjects
+        if tag == 'DataObjects':
+            description = attrib.get('Description', '')
+            data_objects[obj_id] = {
+                'description': description,
+                'description_lower': description.lower(),
+                'desc_short': description[:100],  # display form for result lists
+                'unit_text': attrib.get('UnitText', ''),
             }
-    
-    # Index ExceptionMetadata
-    for elem in root.xpath('.//ExceptionMetadata'):
-        obj_id = elem.get('ObjectID')
-        if obj_id:
-            flash_code = elem.get('FlashCode', '')
-            severity = elem.get('SeverityID', '')
+        
+        # Index ExceptionMetadata
+        elif tag == 'ExceptionMetadata':
+            flash_code = attrib.get('FlashCode', '')
+            severity = intern(attrib.get('SeverityID', ''))
             
-            index['exceptions'][obj_id] = {
-                'corrective_action': elem.get('CorrectiveAction', ''),
+            exceptions[obj_id] = {
+                'corrective_action': attrib.get('CorrectiveAction', ''),
                 'flash_code': flash_code,
                 'severity': severity,
             }
             
             if flash_code:
-                index['flash_codes'][flash_code] = obj_id
+                flash_codes[flash_code] = obj_id
             if severity:
-                index['severity_levels'].add(severity)
-    
-    # Index DataPointMetadata
-    for elem in root.xpath('.//DataPointMetadata'):
-        obj_id = elem.get('ObjectID')
-        if obj_id:
-            manufacturer = elem.get('ManufacturerAndModel', '')
-            bus_type = elem.get('BusType', '')
+                severity_levels.add(severity)
+        
+        # Index DataPointMetadata
+        else:
+            manufacturer = intern(attrib.get('ManufacturerAndModel', ''))
+            bus_type = intern(attrib.get('BusType', ''))
             
-            index['metadata'][obj_id] = {
+            metadata[obj_id] = {
                 'manufacturer': manufacturer,
-                'firmware': elem.get('FirmwareVersion', ''),
+                'firmware': intern(attrib.get('FirmwareVersion', '')),
                 'bus_type': bus_type,
             }
             
             if bus_type:
-                index['bus_types'].add(bus_type)
+                bus_types.add(bus_type)
             if manufacturer:
-                index['manufacturers'].add(manufacturer)
+                manufacturers.add(manufacturer)
+    
+    # Inverted index over description words -> positions in object_ids, so a
+    # keyword search scans the distinct vocabulary instead of every description
+    description_tokens = defaultdict(list)
+    for position, data in enumerate(data_objects.values()):
+        for token in set(_RE_WORD.findall(data['description_lower'])):
+            description_tokens[token].append(position)
+    index['object_ids'] = list(data_objects)
+    index['description_tokens'] = dict(description_tokens)
+    
+    # Bus type -> ObjectIDs, from the stored (last) metadata row of each ObjectID
+    # so a lookup agrees with the report it links to
+    bus_type_index = defaultdict(list)
+    for obj_id, meta in metadata.items():
+        if meta['bus_type']:
+            bus_type_index[meta['bus_type']].append(obj_id)
+    index['bus_type_index'] = dict(bus_type_index)
+    
+    # Lower-cased manufacturer -> positions in metadata_ids, from the same stored
+    # rows; positions let a multi-name match merge back into metadata order
+    manufacturer_index = defaultdict(list)
+    for position, meta in enumerate(metadata.values()):
+        if meta['manufacturer']:
+            manufacturer_index[meta['manufacturer'].lower()].append(position)
+    index['metadata_ids'] = list(metadata)
+    index['manufacturer_index'] = dict(manufacturer_index)
+    
+    # These never change after load: sort once for the list/count answers
+    # and freeze the sets for membership checks
+    for key in ('bus_types', 'manufacturers', 'severity_levels'):
+        index[f'{key}_sorted'] = tuple(sorted(index[key]))
+        index[key] = frozenset(index[key])
+    
+    # Case-folded name -> display name, in sorted order for stable matching
+    index['manufacturers_lower_map'] = {m.casefold(): m for m in index['manufacturers_sorted']}
     
     return index
 
-# Build index if not already done
-if st.session_state.diag_index is None and st.session_state.root is not None:
-    with st.spinner("📊 Indexing diagnostic data by ObjectID..."):
-        st.session_state.diag_index = build_diagnostic_index(st.session_state.root)
+# Saved index files are unprefixed <sha256>.v<INDEX_FORMAT>.idx names
+INDEX_PREFIX = ''
+INDEX_FORMAT = 8
+
+def build_and_save_index(digest, xml_file):
+    """Build the index and save it to disk; no Streamlit calls, so safe off the script thread"""
+    index = build_diagnostic_index(xml_file)
+    # Identifies the source XML; used as the cache key for per-query results
+    index['source_digest'] = digest
+    save_index(INDEX_PREFIX, digest, INDEX_FORMAT, index)
+    return index
+
+@st.cache_resource(show_spinner=False, max_entries=MEMORY_KEEP)
+def load_diagnostic_index(digest, _built_index=None):
+    """One shared index per XML digest: from memory, else a finished build, else disk"""
+    if _built_index is not None:
+        return _built_index
+    
+    index = read_saved_index(INDEX_PREFIX, digest, INDEX_FORMAT)
+    if index is None:
+        raise FileNotFoundError(f"No saved index for XML {digest}")
+    return index
+
+@st.cache_resource
+def get_index_pool():
+    """Worker threads for index builds, shared by all sessions (lxml parses without the GIL)"""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix='xml-index')
+
+@st.cache_resource
+def get_pending_builds():
+    """Index builds still running, by XML digest, shared by all sessions"""
+    return {}, threading.Lock()
 
-diag_index = st.session_state.diag_index
-root = st.session_state.root
+def start_index_build(digest, file_bytes):
+    """Join the running build for this XML, or submit one if none is pending"""
+    pending, lock = get_pending_builds()
+    with lock:
+        build = pending.get(digest)
+        if build is not None:
+            return build
+        source = BytesIO(file_bytes)
+        build = pending[digest] = {
+            'source': source,
+            'size': len(file_bytes),
+            'future': get_index_pool().submit(build_and_save_index, digest, source),
+        }
+    
+    def forget(_future):
+        # Later uploads find the finished index in memory or on disk
+        with lock:
+            if pending.get(digest) is build:
+                del pending[digest]
+    
+    # Outside the lock: the callback runs right here if the build already finished
+    build['future'].add_done_callback(forget)
+    return build
+
+# ================================
+# File Upload Section
+# ================================
+st.title("🚗 Vehicle Diagnostic System Query")
+
+if not st.session_state.xml_loaded:
+    st.markdown("### 📁 Upload Your XML Data Dictionary")
+    st.info("Upload your vehicle diagnostic XML file to begin querying.")
+    
+    uploaded_file = st.file_uploader(
+        "Choose an XML file",
+        type=['xml'],
+        help="Upload your data_dictionary.xml file"
+    )
+    
+    job = st.session_state.index_job
+    if job is not None and (uploaded_file is None or job['file_id'] != uploaded_file.file_id):
+        # The file was removed or replaced; its build is no longer wanted here
+        job = st.session_state.index_job = None
+    
+    if uploaded_file is not None:
+        if job is None:
+            file_bytes = uploaded_file.getvalue()
+            digest = hashlib.sha256(file_bytes).hexdigest()
+            try:
+                # Already indexed by this or another session, or saved on disk
+                load_diagnostic_index(digest)
+            except FileNotFoundError:
+                # Build in the background so the page stays responsive; sessions
+                # uploading the same file share one build
+                job = st.session_state.index_job = {
+                    'file_id': uploaded_file.file_id,
+                    'digest': digest,
+                    **start_index_build(digest, file_bytes),
+                }
+        
+        if job is not None:
+            future = job['future']
+            if not future.done():
+                # The parser's read position in the upload is the build progress
+                done = job['source'].tell() / max(job['size'], 1)
+                st.progress(min(done, 1.0), text="🔄 Loading and indexing XML file...")
+                time.sleep(0.25)
+                st.rerun()
+            
+            st.session_state.index_job = None
+            digest = job['digest']
+            try:
+                load_diagnostic_index(digest, future.result())
+            except Exception as e:
+                st.error(f"❌ Error loading XML: {str(e)}")
+                st.stop()
+        
+        st.session_state.xml_digest = digest
+        st.session_state.xml_loaded = True
+        st.rerun()
+    else:
+        st.warning("⬆️ Please upload an XML file to continue")
+        st.stop()
+
+try:
+    # Keyed by digest only, so reruns never re-hash the file contents
+    diag_index = load_diagnostic_index(st.session_state.xml_digest)
+except FileNotFoundError:
+    # Dropped from the cache and not saved on disk; ask for the file again
+    st.session_state.xml_loaded = False
+    st.session_state.xml_digest = None
+    st.rerun()
 
 # ================================
 # Optional AI Integration
@@ -145,6 +302,23 @@ try:
 except:
     pass
 
+# Fixed instructions go in the system message so the provider can reuse the prefix
+AI_SYSTEM_PROMPT = "You are a vehicle diagnostic expert. Using the diagnostic data provided, give a clear, practical answer."
+
+@st.cache_data(ttl=3600, show_spinner=False, max_entries=256)
+def cached_completion(prompt):
+    """Cache AI answers per prompt so repeated questions skip the API call"""
+    chat = client.chat.completions.create(
+        model="llama-3.3-70b-versatile",
+        messages=[
+            {"role": "system", "content": AI_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        temperature=0,
+        max_tokens=500
+    )
+    return chat.choices[0].message.content
+
 def ask_ai_about_diagnostic(object_id, question):
     """Use AI to provide more detailed analysis"""
     if not USE_AI or not client:
@@ -153,37 +327,25 @@ def ask_ai_about_diagnostic(object_id, question):
     try:
         diag = get_complete_diagnostic(object_id)
         
-        context = f"""
-ObjectID: {object_id}
-
-Signal: {diag['data_object'].get('description', 'N/A') if diag['data_object'] else 'N/A'}
-Unit: {diag['data_object'].get('unit_text', 'N/A') if diag['data_object'] else 'N/A'}
-
-Corrective Action: {diag['exception'].get('corrective_action', 'N/A') if diag['exception'] else 'N/A'}
-Flash Code: {diag['exception'].get('flash_code', 'N/A') if diag['exception'] else 'N/A'}
-Severity: {diag['exception'].get('severity', 'N/A') if diag['exception'] else 'N/A'}
-
-Manufacturer: {diag['metadata'].get('manufacturer', 'N/A') if diag['metadata'] else 'N/A'}
-Firmware: {diag['metadata'].get('firmware', 'N/A') if diag['metadata'] else 'N/A'}
-Bus Type: {diag['metadata'].get('bus_type', 'N/A') if diag['metadata'] else 'N/A'}
-"""
+        data_object = diag['data_object'] or {}
+        exception = diag['exception'] or {}
+        metadata = diag['metadata'] or {}
         
-        prompt = f"""You are a vehicle diagnostic expert. Based on this diagnostic data:
-
-{context}
-
-Question: {question}
-
-Provide a clear, practical answer."""
+        context = "\n".join([
+            f"ObjectID: {object_id}",
+            f"Signal: {data_object.get('description', 'N/A')}",
+            f"Unit: {data_object.get('unit_text', 'N/A')}",
+            f"Corrective Action: {exception.get('corrective_action', 'N/A')}",
+            f"Flash Code: {exception.get('flash_code', 'N/A')}",
+            f"Severity: {exception.get('severity', 'N/A')}",
+            f"Manufacturer: {metadata.get('manufacturer', 'N/A')}",
+            f"Firmware: {metadata.get('firmware', 'N/A')}",
+            f"Bus Type: {metadata.get('bus_type', 'N/A')}",
+        ])
         
-        chat = client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0,
-            max_tokens=500
-        )
+        prompt = f"Diagnostic data:\n{context}\n\nQuestion: {question}"
         
-        return chat.choices[0].message.content
+        return cached_completion(prompt)
     except:
         return None
 
@@ -192,21 +354,31 @@ Provide a clear, practical answer."""
 # ================================
 def get_complete_diagnostic(object_id):
     """Get complete diagnostic info for an ObjectID across all three sections"""
+    key = normalize_object_id(object_id)
     result = {
         'object_id': object_id,
-        'data_object': diag_index['data_objects'].get(object_id),
-        'exception': diag_index['exceptions'].get(object_id),
-        'metadata': diag_index['metadata'].get(object_id)
+        'data_object': diag_index['data_objects'].get(key),
+        'exception': diag_index['exceptions'].get(key),
+        'metadata': diag_index['metadata'].get(key)
     }
     return result
 
 def search_by_description(search_term):
     """Search in DataObject descriptions"""
-    results = []
-    for obj_id, data in diag_index['data_objects'].items():
-        if search_term.lower() in data['description'].lower():
-            results.append(obj_id)
-    return results
+    term = search_term.lower()
+    
+    # Terms with punctuation can span words, so they need the full scan
+    if not _RE_WORD.fullmatch(term):
+        return [obj_id for obj_id, data in diag_index['data_objects'].items()
+                if term in data['description_lower']]
+    
+    # A pure word term can only occur inside a single description word
+    positions = set()
+    for token, token_positions in diag_index['description_tokens'].items():
+        if term in token:
+            positions.update(token_positions)
+    object_ids = diag_index['object_ids']
+    return [object_ids[p] for p in sorted(positions)]
 
 def search_by_flash_code(flash_code):
     """Find ObjectID by FlashCode"""
@@ -214,184 +386,249 @@ def search_by_flash_code(flash_code):
 
 def get_by_manufacturer(manufacturer):
     """Get all ObjectIDs for a specific manufacturer"""
-    results = []
-    for obj_id, data in diag_index['metadata'].items():
-        if manufacturer.lower() in data['manufacturer'].lower():
-            results.append(obj_id)
-    return results
+    term = manufacturer.lower()
+    positions = set()
+    # Scan the distinct manufacturer names, not every metadata row
+    for name, name_positions in diag_index['manufacturer_index'].items():
+        if term in name:
+            positions.update(name_positions)
+    metadata_ids = diag_index['metadata_ids']
+    return [metadata_ids[p] for p in sorted(positions)]
 
 def get_by_bus_type(bus_type):
     """Get all ObjectIDs using a specific BusType"""
-    results = []
-    for obj_id, data in diag_index['metadata'].items():
-        if data['bus_type'] == bus_type:
-            results.append(obj_id)
-    return results
+    return diag_index['bus_type_index'].get(bus_type, [])
 
 def format_diagnostic_report(object_id):
     """Format a complete diagnostic report for an ObjectID"""
     diag = get_complete_diagnostic(object_id)
     
-    report = f"## 🔍 Diagnostic Report for ObjectID: **{object_id}**\n\n"
+    parts = [f"## 🔍 Diagnostic Report for ObjectID: **{object_id}**\n\n"]
     
     # Section 1: Data Signal
     if diag['data_object']:
-        report += "### 📊 Signal Description\n"
-        report += f"**Description:** {diag['data_object']['description']}\n\n"
+        parts.append("### 📊 Signal Description\n")
+        parts.append(f"**Description:** {diag['data_object']['description']}\n\n")
         if diag['data_object']['unit_text']:
-            report += f"**Unit:** {diag['data_object']['unit_text']}\n\n"
+            parts.append(f"**Unit:** {diag['data_object']['unit_text']}\n\n")
     else:
-        report += "### 📊 Signal Description\n❌ No data found\n\n"
+        parts.append("### 📊 Signal Description\n❌ No data found\n\n")
     
     # Section 2: Fault/Exception
     if diag['exception']:
-        report += "### ⚠️ Diagnostic Information\n"
-        report += f"**Corrective Action:** {diag['exception']['corrective_action']}\n\n"
+        parts.append("### ⚠️ Diagnostic Information\n")
+        parts.append(f"**Corrective Action:** {diag['exception']['corrective_action']}\n\n")
         if diag['exception']['flash_code']:
-            report += f"**Flash Code:** `{diag['exception']['flash_code']}`\n\n"
+            parts.append(f"**Flash Code:** `{diag['exception']['flash_code']}`\n\n")
         if diag['exception']['severity']:
-            report += f"**Severity:** {diag['exception']['severity']}\n\n"
+            parts.append(f"**Severity:** {diag['exception']['severity']}\n\n")
     else:
-        report += "### ⚠️ Diagnostic Information\n❌ No exception data found\n\n"
+        parts.append("### ⚠️ Diagnostic Information\n❌ No exception data found\n\n")
     
     # Section 3: Hardware/Firmware
     if diag['metadata']:
-        report += "### 🔧 Hardware & Firmware\n"
-        report += f"**Manufacturer & Model:** {diag['metadata']['manufacturer']}\n\n"
+        parts.append("### 🔧 Hardware & Firmware\n")
+        parts.append(f"**Manufacturer & Model:** {diag['metadata']['manufacturer']}\n\n")
         if diag['metadata']['firmware']:
-            report += f"**Firmware Version:** `{diag['metadata']['firmware']}`\n\n"
+            parts.append(f"**Firmware Version:** `{diag['metadata']['firmware']}`\n\n")
         if diag['metadata']['bus_type']:
-            report += f"**Bus Type:** {diag['metadata']['bus_type']}\n\n"
+            parts.append(f"**Bus Type:** {diag['metadata']['bus_type']}\n\n")
     else:
-        report += "### 🔧 Hardware & Firmware\n❌ No metadata found\n\n"
+        parts.append("### 🔧 Hardware & Firmware\n❌ No metadata found\n\n")
     
-    return report
+    return "".join(parts)
+
+@st.cache_data(show_spinner=False, max_entries=1024)
+def format_diagnostic_report_cached(object_id, index_key):
+    """Memoize reports per ObjectID; index_key ties them to one loaded XML"""
+    return format_diagnostic_report(object_id)
 
 # ================================
 # Query Handler
 # ================================
+# Compiled once at load; one scan picks up every lookup kind in the question
+_RE_LOOKUP = re.compile(
+    r'object\s*id[:\s]+(?P<object_id>\w+)'
+    r'|flash\s*code[:\s]+(?P<flash_code>\w+)'
+    r'|bus\s*type[:\s]+(?P<bus_type>\d+)'
+)
+
+def extract_lookups(q_lower):
+    """Map each lookup kind found in the question to its first value"""
+    lookups = {}
+    for match in _RE_LOOKUP.finditer(q_lower):
+        for kind, value in match.groupdict().items():
+            if value:
+                lookups.setdefault(kind, value)
+    return lookups
+
+# Every word the stats/list routes look at, collected in one scan of the question
+_RE_ROUTE_KEYWORD = re.compile(r'how many|list|show all|bus ?type|manufacturer|object|signal|flash code|fault|severity')
+_ROUTE_ALIASES = {'how many': 'count', 'show all': 'list', 'bustype': 'bus type'}
+
+# Questions that ask for an explanation rather than a listing go to the AI
+_RE_AI_INTENT = re.compile(r'\b(?:why|how|what should|explain|help|troubleshoot)\b')
+
+def route_keywords(q_lower):
+    """Set of routing keywords present in the question"""
+    return {_ROUTE_ALIASES.get(k, k) for k in _RE_ROUTE_KEYWORD.findall(q_lower)}
+
+def count_bus_types():
+    count = len(diag_index['bus_types'])
+    return f"✅ Found **{count}** unique Bus Types: {', '.join(diag_index['bus_types_sorted'])}", "success"
+
+def count_manufacturers():
+    count = len(diag_index['manufacturers'])
+    return f"✅ Found **{count}** manufacturers", "info"
+
+def count_data_objects():
+    count = len(diag_index['data_objects'])
+    return f"✅ Found **{count}** data objects/signals", "success"
+
+def count_flash_codes():
+    count = len(diag_index['flash_codes'])
+    return f"✅ Found **{count}** flash codes", "success"
+
+def list_bus_types():
+    bus_types = diag_index['bus_types_sorted']
+    return f"**All Bus Types ({len(bus_types)}):**\n\n`{', '.join(bus_types)}`", "success"
+
+def list_manufacturers():
+    manufacturers = diag_index['manufacturers_sorted']
+    return f"**All Manufacturers ({len(manufacturers)}):**\n\n" + "\n".join([f"- {m}" for m in manufacturers[:20]]), "info"
+
+def list_severity_levels():
+    severities = diag_index['severity_levels_sorted']
+    return f"**All Severity Levels:**\n\n`{', '.join(severities)}`", "info"
+
+# (intent, any of these keywords, answer), checked in order; first match wins
+_ROUTES = (
+    ('count', ('bus type',), count_bus_types),
+    ('count', ('manufacturer',), count_manufacturers),
+    ('count', ('object', 'signal'), count_data_objects),
+    ('count', ('flash code', 'fault'), count_flash_codes),
+    ('list', ('bus type',), list_bus_types),
+    ('list', ('manufacturer',), list_manufacturers),
+    ('list', ('severity',), list_severity_levels),
+)
+
 def handle_query(question):
     if not question.strip():
         return "Please enter a question.", "warning"
     
     q_lower = question.lower()
     
-    # Stats queries
-    if "how many" in q_lower:
-        if "bus type" in q_lower or "bustype" in q_lower:
-            count = len(diag_index['bus_types'])
-            return f"✅ Found **{count}** unique Bus Types: {', '.join(sorted(diag_index['bus_types']))}", "success"
-        
-        if "manufacturer" in q_lower:
-            count = len(diag_index['manufacturers'])
-            return f"✅ Found **{count}** manufacturers", "info"
-        
-        if "object" in q_lower or "signal" in q_lower:
-            count = len(diag_index['data_objects'])
-            return f"✅ Found **{count}** data objects/signals", "success"
-        
-        if "flash code" in q_lower or "fault" in q_lower:
-            count = len(diag_index['flash_codes'])
-            return f"✅ Found **{count}** flash codes", "success"
-    
-    # List queries
-    if "list" in q_lower or "show all" in q_lower:
-        if "bus type" in q_lower or "bustype" in q_lower:
-            bus_types = sorted(diag_index['bus_types'])
-            return f"**All Bus Types ({len(bus_types)}):**\n\n`{', '.join(bus_types)}`", "success"
-        
-        if "manufacturer" in q_lower:
-            manufacturers = sorted(diag_index['manufacturers'])
-            return f"**All Manufacturers ({len(manufacturers)}):**\n\n" + "\n".join([f"- {m}" for m in manufacturers[:20]]), "info"
-        
-        if "severity" in q_lower:
-            severities = sorted(diag_index['severity_levels'])
-            return f"**All Severity Levels:**\n\n`{', '.join(severities)}`", "info"
+    # Stats and list queries
+    keywords = route_keywords(q_lower)
+    for intent, triggers, answer in _ROUTES:
+        if intent in keywords and not keywords.isdisjoint(triggers):
+            return answer()
+    
+    lookups = extract_lookups(q_lower)
     
     # ObjectID lookup
-    match = re.search(r'object\s*id[:\s]+(\w+)', q_lower)
-    if match:
-        obj_id = match.group(1)
-        return format_diagnostic_report(obj_id), "info"
+    obj_id = lookups.get('object_id')
+    if obj_id:
+        return format_diagnostic_report_cached(obj_id, diag_index['source_digest']), "info"
     
     # Flash code lookup
-    match = re.search(r'flash\s*code[:\s]+(\w+)', q_lower)
-    if match:
-        flash_code = match.group(1)
+    flash_code = lookups.get('flash_code')
+    if flash_code:
         obj_id = search_by_flash_code(flash_code)
-        if obj_id:
-            return format_diagnostic_report(obj_id), "info"
+        if obj_id is not None:
+            return format_diagnostic_report_cached(obj_id, diag_index['source_digest']), "info"
         else:
             return f"❌ Flash code '{flash_code}' not found", "error"
     
     # Bus type lookup
-    match = re.search(r'bus\s*type[:\s]+(\d+)', q_lower)
-    if match:
-        bus_type = match.group(1)
+    bus_type = lookups.get('bus_type')
+    if bus_type:
         obj_ids = get_by_bus_type(bus_type)
         if obj_ids:
-            result = f"✅ Found **{len(obj_ids)}** objects using Bus Type {bus_type}\n\n"
+            parts = [f"✅ Found **{len(obj_ids)}** objects using Bus Type {bus_type}\n\n"]
             for obj_id in obj_ids[:5]:
                 data = diag_index['data_objects'].get(obj_id, {})
-                result += f"- **ObjectID {obj_id}:** {data.get('description', 'N/A')[:100]}\n"
+                parts.append(f"- **ObjectID {obj_id}:** {data.get('desc_short', 'N/A')}\n")
             if len(obj_ids) > 5:
-                result += f"\n... and {len(obj_ids) - 5} more"
-            return result, "info"
+                parts.append(f"\n... and {len(obj_ids) - 5} more")
+            return "".join(parts), "info"
         else:
             return f"❌ No objects found for Bus Type {bus_type}", "error"
     
     # Manufacturer search
-    if "manufacturer" in q_lower or "cummins" in q_lower or "clever" in q_lower:
-        search_term = q_lower.replace("manufacturer", "").strip()
-        for manufacturer in diag_index['manufacturers']:
-            if search_term in manufacturer.lower() or manufacturer.lower() in search_term:
-                obj_ids = get_by_manufacturer(manufacturer)
-                result = f"✅ Found **{len(obj_ids)}** objects for **{manufacturer}**\n\n"
-                for obj_id in obj_ids[:5]:
-                    data = diag_index['data_objects'].get(obj_id, {})
-                    result += f"- **ObjectID {obj_id}:** {data.get('description', 'N/A')[:100]}\n"
-                if len(obj_ids) > 5:
-                    result += f"\n... and {len(obj_ids) - 5} more"
-                return result, "info"
-    
-    # Description search
+    if "manufacturer" in keywords or "cummins" in q_lower or "clever" in q_lower:
+        search_cf = q_lower.replace("manufacturer", "").strip().casefold()
+        lower_map = diag_index['manufacturers_lower_map']
+        # Exact name first, then partial match either way
+        match_cf = search_cf if search_cf in lower_map else next(
+            (name for name in lower_map if search_cf in name or name in search_cf), None
+        )
+        if match_cf is not None:
+            manufacturer = lower_map[match_cf]
+            obj_ids = get_by_manufacturer(manufacturer)
+            parts = [f"✅ Found **{len(obj_ids)}** objects for **{manufacturer}**\n\n"]
+            for obj_id in obj_ids[:5]:
+                data = diag_index['data_objects'].get(obj_id, {})
+                parts.append(f"- **ObjectID {obj_id}:** {data.get('desc_short', 'N/A')}\n")
+            if len(obj_ids) > 5:
+                parts.append(f"\n... and {len(obj_ids) - 5} more")
+            return "".join(parts), "info"
+    
+    # Description search: find the first term with hits once, for both branches below
     search_terms = [word for word in q_lower.split() if len(word) > 4]
-    if search_terms:
-        for term in search_terms:
-            obj_ids = search_by_description(term)
-            if obj_ids:
-                result = f"✅ Found **{len(obj_ids)}** signals matching '{term}'\n\n"
-                for obj_id in obj_ids[:5]:
-                    data = diag_index['data_objects'].get(obj_id, {})
-                    result += f"- **ObjectID {obj_id}:** {data.get('description', 'N/A')[:100]}\n"
-                if len(obj_ids) > 5:
-                    result += f"\n... and {len(obj_ids) - 5} more. Try 'ObjectID {obj_ids[5]}' for details."
-                return result, "info"
-    
-    # Try AI for complex questions
-    if USE_AI and any(word in q_lower for word in ["why", "how", "what should", "explain", "help", "troubleshoot"]):
-        for term in search_terms:
-            obj_ids = search_by_description(term)
-            if obj_ids:
-                ai_response = ask_ai_about_diagnostic(obj_ids[0], question)
-                if ai_response:
-                    return f"🤖 **AI Analysis:**\n\n{ai_response}\n\n---\n\n**Related ObjectID:** {obj_ids[0]}", "success"
+    term, obj_ids = None, []
+    for term in search_terms:
+        obj_ids = search_by_description(term)
+        if obj_ids:
+            break
+    
+    # Try AI for complex questions; whole words only, so "show" is not "how"
+    if obj_ids and USE_AI and _RE_AI_INTENT.search(q_lower):
+        ai_response = ask_ai_about_diagnostic(obj_ids[0], question)
+        if ai_response:
+            return f"🤖 **AI Analysis:**\n\n{ai_response}\n\n---\n\n**Related ObjectID:** {obj_ids[0]}", "success"
+    
+    if obj_ids:
+        parts = [f"✅ Found **{len(obj_ids)}** signals matching '{term}'\n\n"]
+        for obj_id in obj_ids[:5]:
+            data = diag_index['data_objects'].get(obj_id, {})
+            parts.append(f"- **ObjectID {obj_id}:** {data.get('desc_short', 'N/A')}\n")
+        if len(obj_ids) > 5:
+            parts.append(f"\n... and {len(obj_ids) - 5} more. Try 'ObjectID {obj_ids[5]}' for details.")
+        return "".join(parts), "info"
     
     return "❌ Query not understood. Try: 'How many bus types?' or 'Show ObjectID 12345' or 'Flash code 523'", "error"
 
+@st.cache_data(ttl=3600, show_spinner=False, max_entries=256)
+def handle_query_cached(question, index_key):
+    """Memoize answers per question; index_key ties them to one loaded XML"""
+    return handle_query(question)
+
 # ================================
 # Main UI (only if XML loaded)
 # ================================
-st.markdown("**Search vehicle performance data, faults, and hardware info using ObjectID**")
+EXAMPLE_QUERIES = (
+    "How many bus types are present?",
+    "List all manufacturers",
+    "Show bus type 38",
+    "Search for engine oil pressure",
+    "Search for brake",
+    "Flash code 523",
+)
 
-# Sidebar
-with st.sidebar:
+AI_EXAMPLE_QUERIES = (
+    "Why would engine oil pressure be low? (AI)",
+    "How do I troubleshoot brake issues? (AI)",
+)
+
+def render_sidebar(index):
+    """Sidebar overview, reload button and example queries"""
     st.header("📊 System Overview")
-    st.metric("Data Signals", len(diag_index['data_objects']))
-    st.metric("Exception Codes", len(diag_index['exceptions']))
-    st.metric("Flash Codes", len(diag_index['flash_codes']))
-    st.metric("Bus Types", len(diag_index['bus_types']))
-    st.metric("Manufacturers", len(diag_index['manufacturers']))
+    st.metric("Data Signals", len(index['data_objects']))
+    st.metric("Exception Codes", len(index['exceptions']))
+    st.metric("Flash Codes", len(index['flash_codes']))
+    st.metric("Bus Types", len(index['bus_types']))
+    st.metric("Manufacturers", len(index['manufacturers']))
     
     if USE_AI:
         st.success("🤖 AI Mode: Enabled")
@@ -403,28 +640,14 @@ with st.sidebar:
     # Add reload button
     if st.button("🔄 Load New XML File", use_container_width=True):
         st.session_state.xml_loaded = False
-        st.session_state.root = None
-        st.session_state.diag_index = None
+        st.session_state.xml_digest = None
         st.session_state.history = []
         st.rerun()
     
     st.markdown("---")
     st.header("💡 Example Queries")
     
-    examples = [
-        "How many bus types are present?",
-        "List all manufacturers",
-        "Show bus type 38",
-        "Search for engine oil pressure",
-        "Search for brake",
-        "Flash code 523",
-    ]
-    
-    if USE_AI:
-        examples.extend([
-            "Why would engine oil pressure be low? (AI)",
-            "How do I troubleshoot brake issues? (AI)"
-        ])
+    examples = EXAMPLE_QUERIES + AI_EXAMPLE_QUERIES if USE_AI else EXAMPLE_QUERIES
     
     for example in examples:
         if st.button(example, key=example, use_container_width=True):
@@ -434,6 +657,22 @@ with st.sidebar:
     st.markdown("---")
     st.info("💡 **Tip:** Use ObjectID to link signals → faults → hardware")
 
+def render_history():
+    """Recent queries and their answers"""
+    if st.session_state.history:
+        st.markdown("---")
+        st.subheader("📜 Recent Queries")
+        
+        for i, item in enumerate(st.session_state.history[:5]):
+            with st.expander(f"Q: {item['query']}", expanded=(i==0)):
+                st.markdown(item['answer'])
+
+st.markdown("**Search vehicle performance data, faults, and hardware info using ObjectID**")
+
+# Sidebar
+with st.sidebar:
+    render_sidebar(diag_index)
+
 # Main query interface
 col1, col2 = st.columns([3, 1])
 
@@ -456,7 +695,7 @@ if search_clicked or st.session_state.should_search:
     
     if query:
         with st.spinner("Searching..."):
-            answer, status = handle_query(query)
+            answer, status = handle_query_cached(query, diag_index['source_digest'])
         
         # Display answer
         if status == "success":
@@ -477,13 +716,7 @@ if search_clicked or st.session_state.should_search:
         st.session_state.history = st.session_state.history[:10]
 
 # Show history
-if st.session_state.history:
-    st.markdown("---")
-    st.subheader("📜 Recent Queries")
-    
-    for i, item in enumerate(st.session_state.history[:5]):
-        with st.expander(f"Q: {item['query']}", expanded=(i==0)):
-            st.markdown(item['answer'])
+render_history()
 
 # Footer
 st.markdown("---")
@@ -1,59 +1,97 @@
 import streamlit as st
-from lxml import etree
 import re
+import sys
+import hashlib
+from io import BytesIO
 from collections import defaultdict
+from index_cache import MEMORY_KEEP, iter_indexed_elements, read_saved_index, save_index
 
 # ================================
 # Core Logic: Data Indexing
 # ================================
+# Only these three element types carry data we index
+INDEXED_TAGS = ('DataObjects', 'ExceptionMetadata', 'DataPointMetadata')
+
 def build_index(file):
     """Indexes the entire XML into memory for instant lookup."""
     try:
-        tree = etree.parse(file)
-        root = tree.getroot()
-        
         index = {
             'signals': {},      # ObjectID -> Description
+            'signals_lower': {},  # ObjectID -> lower-cased Description for search
             'faults': {},       # ObjectID -> Corrective Action
-            'metadata': defaultdict(list), # ObjectID -> List of HW Configs
+            'metadata': defaultdict(dict), # ObjectID -> unique (bus, mfg, fw) HW Configs
             'bus_types': set(),
-            'manufacturers': set()
+            'manufacturers': set(),
+            'oid_buses': {}     # ObjectID -> sorted unique Bus Types
         }
 
-        # 1. Map Data Signal Descriptions
-        for elem in root.xpath('.//DataObjects'):
-            oid = elem.get('ObjectID')
-            if oid:
-                index['signals'][oid] = elem.get('Description', 'No description available')
-
-        # 2. Map Faults/Corrective Actions
-        for elem in root.xpath('.//ExceptionMetadata'):
-            oid = elem.get('ObjectID')
-            if oid:
-                index['faults'][oid] = {
-                    'action': elem.get('CorrectiveAction', 'N/A'),
-                    'flash': elem.get('FlashCode', 'N/A')
+        signals = index['signals']
+        signals_lower = index['signals_lower']
+        faults = index['faults']
+        configs_for = index['metadata'].__getitem__
+        add_bus_type = index['bus_types'].add
+        add_manufacturer = index['manufacturers'].add
+
+        intern = sys.intern
+
+        for tag, oid, attrib in iter_indexed_elements(file, INDEXED_TAGS):
+            # 1. Map Data Signal Descriptions
+            if tag == 'DataObjects':
+                desc = attrib.get('Description', 'No description available')
+                signals[oid] = desc
+                signals_lower[oid] = desc.lower()
+
+            # 2. Map Faults/Corrective Actions
+            elif tag == 'ExceptionMetadata':
+                faults[oid] = {
+                    'action': attrib.get('CorrectiveAction', 'N/A'),
+                    'flash': attrib.get('FlashCode', 'N/A')
                 }
 
-        # 3. Map ALL Metadata (Crucial for multi-bus IDs)
-        for elem in root.xpath('.//DataPointMetadata'):
-            oid = elem.get('ObjectID')
-            bt = elem.get('BusType', '')
-            if oid:
-                index['metadata'][oid].append({
-                    'bus': bt,
-                    'mfg': elem.get('ManufacturerAndModel', 'N/A'),
-                    'fw': elem.get('FirmwareVersion', 'N/A')
-                })
-                if bt: index['bus_types'].add(bt)
-                if elem.get('ManufacturerAndModel'): 
-                    index['manufacturers'].add(elem.get('ManufacturerAndModel'))
+            # 3. Map ALL Metadata (Crucial for multi-bus IDs)
+            else:
+                bt = intern(attrib.get('BusType', ''))
+                raw_mfg = attrib.get('ManufacturerAndModel')
+                mfg = 'N/A' if raw_mfg is None else intern(raw_mfg)
+                fw = intern(attrib.get('FirmwareVersion', 'N/A'))
+                # Same config repeated across contexts is stored once;
+                # the dict is only an ordered set of plain tuples
+                configs_for(oid)[(bt, mfg, fw)] = None
+                if bt: add_bus_type(bt)
+                if raw_mfg:
+                    add_manufacturer(mfg)
+
+        # Keep display order as a list of (bus, mfg, fw) tuples
+        index['metadata'] = {oid: list(cfgs) for oid, cfgs in index['metadata'].items()}
+
+        # Unique buses per ID never change after load, so resolve them once here
+        index['oid_buses'] = {
+            oid: tuple(sorted({bus for bus, _, _ in cfgs if bus}))
+            for oid, cfgs in index['metadata'].items()
+        }
         
         return index
     except Exception as e:
         st.error(f"Error reading XML: {e}")
         return None
 
+# The cap- prefix keeps Cap.py's saved index files separate from COPY.py's
+# in the shared .cache/ directory
+INDEX_PREFIX = 'cap-'
+INDEX_FORMAT = 1
+
+@st.cache_resource(show_spinner="Indexing XML...", max_entries=MEMORY_KEEP)
+def build_index_cached(file_bytes):
+    """Builds the index once per distinct upload, reused across reruns and restarts."""
+    digest = hashlib.sha256(file_bytes).hexdigest()
+    index = read_saved_index(INDEX_PREFIX, digest, INDEX_FORMAT)
+    if index is None:
+        index = build_index(BytesIO(file_bytes))
+        # Failed parses return None and are not saved
+        if index is not None:
+            save_index(INDEX_PREFIX, digest, INDEX_FORMAT, index)
+    return index
+
 # ================================
 # Generalized Search Handler
 # ================================
@@ -68,7 +106,7 @@ def generalized_search(query, index):
         signal = index['signals'].get(target_id, "Signal not found")
         fault = index['faults'].get(target_id, {})
         hw_configs = index['metadata'].get(target_id, [])
-        unique_buses = sorted(list(set(m['bus'] for m in hw_configs if m['bus'])))
+        unique_buses = index['oid_buses'].get(target_id, ())
 
         # Display result
         st.markdown(f"### 📋 Analysis for ID: `{target_id}`")
@@ -80,44 +118,56 @@ def generalized_search(query, index):
         if hw_configs:
             st.success(f"🚌 **Bus Types Found ({len(unique_buses)}):** {', '.join(unique_buses)}")
             with st.expander("View Hardware/Firmware Details"):
-                for cfg in hw_configs:
-                    st.write(f"- **{cfg['mfg']}** | FW: `{cfg['fw']}` | Bus: {cfg['bus']}")
+                for bus, mfg, fw in hw_configs:
+                    st.write(f"- **{mfg}** | FW: `{fw}` | Bus: {bus}")
         else:
             st.error("No hardware metadata found for this ID.")
             
     else:
         # If it's text, search descriptions
-        matches = [oid for oid, desc in index['signals'].items() if q.lower() in desc.lower()]
+        q_lower = q.lower()
+        matches = [oid for oid, desc in index['signals_lower'].items() if q_lower in desc]
         if matches:
             st.write(f"🔍 Found **{len(matches)}** IDs matching '{q}':")
             for m in matches[:10]:
-                st.button(f"ID {m}: {index['signals'][m][:100]}...", on_click=lambda id=m: generalized_search(id, index))
+                st.button(f"ID {m}: {index['signals'][m][:100]}...", on_click=select_id, args=(m,))
         else:
             st.error("No results found. Please enter a valid ObjectID or Keyword.")
 
+def select_id(oid):
+    """Result button callback: remember the ID; the search fragment renders it."""
+    st.session_state.selected_id = oid
+
 # ================================
 # Streamlit UI
 # ================================
 st.set_page_config(page_title="General XML Search", layout="wide")
 
-if 'index' not in st.session_state:
-    st.session_state.index = None
+@st.fragment
+def search_fragment(index):
+    """Search box and results; reruns on its own without redrawing the sidebar."""
+    user_query = st.text_input("Enter any ObjectID or keyword:")
+    
+    # A clicked result is shown once, on the rerun its button triggers
+    selected_id = st.session_state.pop('selected_id', None)
+    if selected_id is not None:
+        generalized_search(selected_id, index)
+    
+    if user_query:
+        generalized_search(user_query, index)
 
 uploaded_file = st.sidebar.file_uploader("Upload XML", type="xml")
 
 if uploaded_file:
-    if not st.session_state.index:
-        st.session_state.index = build_index(uploaded_file)
-    
-    idx = st.session_state.index
+    # Keyed on the file bytes, so a different upload re-indexes automatically
+    idx = build_index_cached(uploaded_file.getvalue())
+    if idx is None:
+        st.stop()
     
     # Sidebar Overview
     st.sidebar.metric("Unique Bus Types", len(idx['bus_types']))
     st.sidebar.metric("Unique Signals", len(idx['signals']))
     
-    user_query = st.text_input("Enter any ObjectID or keyword:")
-    
-    if user_query:
-        generalized_search(user_query, idx)
+    search_fragment(idx)
 else:
     st.info("Upload the XML file to begin searching.")
@@ -0,0 +1,97 @@
+"""Shared XML streaming and index caching used by Cap.py and COPY.py."""
+import os
+import re
+import pickle
+import tempfile
+from lxml import etree
+
+# Drop whitespace-only nodes and skip the ID table; neither app uses either
+XML_PARSE_OPTIONS = dict(
+    remove_blank_text=True, huge_tree=True, collect_ids=False, resolve_entities=False
+)
+
+def iter_indexed_elements(xml_file, tags):
+    """Stream (tag, ObjectID, attrib) for each listed element that has an ObjectID.
+
+    Single pass with no DOM kept: each element, and the siblings processed
+    before it, is freed once the caller moves on, so read attrib right away.
+    """
+    for _, elem in etree.iterparse(xml_file, events=('end',), tag=tags, **XML_PARSE_OPTIONS):
+        obj_id = elem.get('ObjectID')
+        if obj_id:
+            yield elem.tag, obj_id, elem.attrib
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+# Indexes kept in each app's st.cache_resource; the rest reload from disk
+MEMORY_KEEP = 8
+
+# Built indexes are saved here as <prefix><sha256>.v<version>.idx, one prefix per app.
+# Each app bumps its version whenever its index layout changes so old files are ignored.
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')
+# Saved indexes kept per app; older versions and the least recently used go
+CACHE_KEEP = 16
+
+def cache_path(prefix, digest, version):
+    """Saved-index file for one XML digest and index version"""
+    return os.path.join(CACHE_DIR, f"{prefix}{digest}.v{version}.idx")
+
+def read_saved_index(prefix, digest, version):
+    """Load a previously saved index, or None if there is no usable file"""
+    path = cache_path(prefix, digest, version)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            index = pickle.load(f)
+    except Exception:
+        return None  # Unreadable cache file; treat it as missing
+    try:
+        os.utime(path)  # Mark as recently used so pruning keeps it
+    except OSError:
+        pass
+    return index
+
+def prune_saved_indexes(prefix, version):
+    """Remove this app's saved indexes from other versions and beyond CACHE_KEEP"""
+    pattern = re.compile(re.escape(prefix) + r'[0-9a-f]{64}\.v(\d+)\.idx')
+    current = []
+    for entry in os.scandir(CACHE_DIR):
+        match = pattern.fullmatch(entry.name)
+        if not match:
+            continue
+        try:
+            if int(match.group(1)) != version:
+                os.remove(entry.path)
+            else:
+                current.append((entry.stat().st_mtime, entry.path))
+        except OSError:
+            pass  # Already removed by another session
+    current.sort(reverse=True)
+    for _, path in current[CACHE_KEEP:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def save_index(prefix, digest, version, index):
+    """Write an index atomically, then prune; a read-only or full disk is ignored"""
+    tmp_path = None
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Write to a temp file first so other sessions never read a partial index
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path(prefix, digest, version))
+        tmp_path = None
+        prune_saved_indexes(prefix, version)
+    except OSError:
+        pass  # The in-memory index is still usable
+    finally:
+        if tmp_path is not None:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass